@@ -1,15 +1,61 @@
 import fitz  # PyMuPDF
 import os
-import json
+import orjson
 import unicodedata
+import heapq
 from collections import defaultdict
 import logging
+import multiprocessing
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
-def is_bold(span):
-    return (span.get("flags", 0) & 2 != 0) or ("Bold" in span.get("font", ""))
+# Image blocks carry no "lines" and are skipped anyway, so don't extract them.
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+FONT_LEVELS = ("title", "H1", "H2", "H3", "H4")  # Largest font style first
+
+UNWANTED_KEYWORDS = frozenset()  # Disabled for multilingual support
+
+def make_keyword_matcher(keywords):
+    """Return a function telling whether any of ``keywords`` occurs in a text.
+
+    Uses a single Aho-Corasick automaton when pyahocorasick is installed, so
+    the scan stays linear in the text however many keywords there are.
+    """
+    if not keywords:
+        return lambda text: False
+    if ahocorasick is None:
+        return lambda text: any(word in text for word in keywords)
+    automaton = ahocorasick.Automaton()
+    for word in keywords:
+        automaton.add_word(word, word)
+    automaton.make_automaton()
+    return lambda text: next(automaton.iter(text), None) is not None
+
+has_unwanted_keyword = make_keyword_matcher(UNWANTED_KEYWORDS)
+
+BOLD_FLAG = 2  # Span flag bit the extractor treats as bold
+
+_font_bold_cache = {}
+
+def is_bold(span, cache=_font_bold_cache):
+    if span["flags"] & BOLD_FLAG:
+        return True
+    # Documents reuse a handful of fonts, so remember the name check.
+    font = span["font"]
+    bold = cache.get(font)
+    if bold is None:
+        bold = cache[font] = "Bold" in font
+    return bold
 
 def extract_title_and_headings(pdf_path):
     try:
@@ -19,106 +65,71 @@ def extract_title_and_headings(pdf_path):
         return None
 
     font_stats = defaultdict(int)
-    text_blocks = []
+    text_blocks = []  # (text, font_size, bold, page) per non-empty line
+    text_blocks_append = text_blocks.append
 
-    for page_num in range(len(doc)):
+    # Hot-loop names bound to locals to avoid repeated global lookups.
+    _round = round
+    _is_bold = is_bold
+    page_count = doc.page_count
+
+    for page_num in range(page_count):
         page = doc.load_page(page_num)
-        blocks = page.get_text("dict")["blocks"]
+        textpage = page.get_textpage(flags=TEXT_FLAGS)
+        blocks = textpage.extractDICT()["blocks"]
+        textpage = None
         for block in blocks:
             if "lines" not in block:
                 continue
             for line in block["lines"]:
-                line_text = ""
-                y = 0
-                font_size = 0
-                bold = False
-                fonts = set()
-                for span in line["spans"]:
-                    font_size = round(span["size"], 1)
-                    y = span["bbox"][1]
-                    fonts.add(span.get("font", ""))
-                    if is_bold(span):
-                        bold = True
-                    line_text += span["text"] + " "  # Preserve spacing
-                if line_text.strip():
-                    font_key = (font_size, bold)
-                    font_stats[font_key] += 1
-                    text_blocks.append({
-                        "text": line_text.strip(),
-                        "font_size": font_size,
-                        "font_names": list(fonts),
-                        "bold": bold,
-                        "y": y,
-                        "page": page_num + 1
-                    })
-
-    sorted_fonts = sorted(font_stats.items(), key=lambda x: (-x[0][0], -x[1]))
-    font_mapping = {}
-    if sorted_fonts:
-        font_mapping["title"] = sorted_fonts[0][0]
-        if len(sorted_fonts) > 1:
-            font_mapping["H1"] = sorted_fonts[1][0]
-        if len(sorted_fonts) > 2:
-            font_mapping["H2"] = sorted_fonts[2][0]
-        if len(sorted_fonts) > 3:
-            font_mapping["H3"] = sorted_fonts[3][0]
-        if len(sorted_fonts) > 4:
-            font_mapping["H4"] = sorted_fonts[4][0]
-    else:
+                spans = line["spans"]
+                line_text = " ".join([span["text"] for span in spans]).strip()  # Preserve spacing
+                if line_text:
+                    # The line takes the size of its last span.
+                    last_span = spans[-1]
+                    font_size = _round(last_span["size"], 1)
+                    bold = any(map(_is_bold, spans))
+                    font_stats[(font_size, bold)] += 1
+                    text_blocks_append((line_text, font_size, bold, page_num + 1))
+
+    # Only the largest few styles get a level, so pick them without sorting
+    # the whole histogram. nsmallest keeps sorted()'s tie order.
+    top_fonts = heapq.nsmallest(len(FONT_LEVELS), font_stats.items(), key=lambda x: (-x[0][0], -x[1]))
+    font_mapping = {level: font_key for level, (font_key, _) in zip(FONT_LEVELS, top_fonts)}
+    if not font_mapping:
         logging.warning(f"PDF {pdf_path} may not have enough font variety for heading detection.")
 
-    def group_blocks(blocks):
-        grouped = []
-        current_group = []
-        prev_size = None
-        prev_bold = None
-        prev_page = None
-        for block in blocks:
-            size = block["font_size"]
-            bold = block["bold"]
-            page = block["page"]
-            if size == prev_size and bold == prev_bold and page == prev_page:
-                current_group.append(block)
-            else:
-                if current_group:
-                    grouped.append(current_group)
-                current_group = [block]
-            prev_size = size
-            prev_bold = bold
-            prev_page = page
-        if current_group:
-            grouped.append(current_group)
-        return grouped
-
-    grouped_blocks = group_blocks(text_blocks)
+    # Consecutive lines sharing font size, weight and page form one group.
+    grouped_blocks = [
+        list(group)
+        for _, group in groupby(text_blocks, key=itemgetter(1, 2, 3))
+    ]
 
     title = ""
     outline = []
     heading_freq = {}
     headings_on_page = defaultdict(int)
 
-    unwanted_keywords = set()  # Disabled for multilingual support
-
     for group in grouped_blocks:
         if not group:
             continue
-        size = group[0]["font_size"]
-        bold = group[0]["bold"]
+        _, size, bold, page = group[0]
         font_key = (size, bold)
-        page = group[0]["page"]
         level = None
         for k, v in font_mapping.items():
             if font_key == v:
                 level = k
                 break
+        if level is None:
+            continue  # Body text: skip joining and NFKC normalisation
 
-        combined_text = " ".join([b["text"] for b in group])
+        combined_text = " ".join([text for text, _, _, _ in group])
         key = unicodedata.normalize("NFKC", combined_text.strip().lower())
         word_count = len(combined_text.split())
 
         # --- Filter title ---
         if level == "title" and not title and page <= 1 and word_count < 20:
-            if any(x in key for x in unwanted_keywords) or "---" in key:
+            if has_unwanted_keyword(key) or "---" in key:
                 continue
             title = combined_text.strip()
             continue
@@ -131,7 +142,7 @@ def extract_title_and_headings(pdf_path):
                 continue
             if combined_text.count(":") > 2:
                 continue
-            if any(word in key for word in unwanted_keywords):
+            if has_unwanted_keyword(key):
                 continue
             heading_freq[key] = heading_freq.get(key, 0) + 1
             if heading_freq[key] > 1:
@@ -147,39 +158,50 @@ def extract_title_and_headings(pdf_path):
             })
             headings_on_page[page] += 1
 
-    # Fallback: if title still empty, take first line on page 1
-    if not title:
-        for block in text_blocks:
-            if block["page"] == 1:
-                title = block["text"]
-                break
+    # Fallback: if title still empty, take first line on page 1. Blocks are
+    # in page order, so that line can only be the very first one.
+    if not title and text_blocks and text_blocks[0][3] == 1:
+        title = text_blocks[0][0]
 
     return {
         "title": title,
         "outline": outline
     }
 
+def process_one(pdf_path, output_dir):
+    logging.info(f"Processing {pdf_path}")
+    result = extract_title_and_headings(pdf_path)
+    if result is None:
+        logging.warning(f"Skipping {pdf_path} due to previous errors.")
+        return pdf_path
+    output_filename = os.path.basename(pdf_path).replace(".pdf", ".json")
+    output_path = os.path.join(output_dir, output_filename)
+    try:
+        with open(output_path, "wb") as f:
+            f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+        logging.info(f"Wrote output to {output_path}")
+    except Exception as e:
+        logging.error(f"Failed to write JSON for {pdf_path}: {e}")
+    return pdf_path
+
 def main():
     input_dir = "/app/input"
     output_dir = "/app/output"
     os.makedirs(output_dir, exist_ok=True)
 
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".pdf"):
-            pdf_path = os.path.join(input_dir, filename)
-            logging.info(f"Processing {pdf_path}")
-            result = extract_title_and_headings(pdf_path)
-            if result is None:
-                logging.warning(f"Skipping {pdf_path} due to previous errors.")
-                continue
-            output_filename = filename.replace(".pdf", ".json")
-            output_path = os.path.join(output_dir, output_filename)
-            try:
-                with open(output_path, "w", encoding="utf-8") as f:
-                    json.dump(result, f, indent=2, ensure_ascii=False)
-                logging.info(f"Wrote output to {output_path}")
-            except Exception as e:
-                logging.error(f"Failed to write JSON for {pdf_path}: {e}")
+    with os.scandir(input_dir) as it:
+        pdf_files = [entry.path for entry in it
+                     if entry.name.endswith(".pdf") and entry.is_file()]
+    if not pdf_files:
+        return
+
+    # Each PDF is independent, so spread them across all cores. Workers write
+    # their own JSON and log their own failures, handing back only the path.
+    worker = partial(process_one, output_dir=output_dir)
+    processes = min(os.cpu_count() or 1, len(pdf_files))
+    with multiprocessing.Pool(processes=processes) as pool:
+        for _ in pool.imap_unordered(worker, pdf_files, chunksize=1):
+            pass
 
 if __name__ == "__main__":
     logging.info("Starting processing pdfs")